@@ -7,8 +7,20 @@ Prof. Francisco Fambrini
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
 import snowflake.connector
+import duckdb
+import queue
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
+from threading import Semaphore
+from uuid import uuid4
 
 # ============================================================================
 # CONFIGURAÇÃO DA PÁGINA
@@ -21,12 +33,23 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Serializar figuras Plotly com orjson (encoder em C, suporte nativo a
+# numpy) em vez do json da stdlib — vale para todos os st.plotly_chart
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = 'orjson'
+except ImportError:
+    pass
+
 # ============================================================================
 # FUNÇÕES DE CONEXÃO
 # ============================================================================
 
-@st.cache_resource
-def init_connection():
+# Conexões simultâneas com o Snowflake: ajustar ao nº de clusters do
+# warehouse (casa com o Semaphore da aba SQL e as threads do Dashboard)
+POOL_SIZE = 4
+
+def _nova_conexao():
     """Cria conexão com Snowflake usando secrets.toml"""
     return snowflake.connector.connect(
         user=st.secrets["snowflake"]["user"],
@@ -38,23 +61,332 @@ def init_connection():
         role=st.secrets["snowflake"]["role"]
     )
 
+@st.cache_resource
+def obter_pool():
+    """Pool de conexões compartilhado entre sessões (uma vez por processo).
+
+    Uma conexão única serializa todas as queries; com o pool, as buscas
+    em threads do Dashboard e a aba SQL andam de fato em paralelo.
+    """
+    pool = queue.Queue(maxsize=POOL_SIZE)
+    for _ in range(POOL_SIZE):
+        pool.put(_nova_conexao())
+    return pool
+
+@contextmanager
+def emprestar_conexao():
+    """Empresta uma conexão do pool e a devolve ao final do bloco"""
+    pool = obter_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+@st.cache_data(ttl=60)
+def verificar_conexao():
+    """Sonda leve de conectividade (cache de 1 minuto)"""
+    with emprestar_conexao() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+        finally:
+            cur.close()
+    return True
+
+@st.cache_resource
+def preparar_view_menu():
+    """Garante a view MENU_ENRICHED no Snowflake (uma vez por processo).
+
+    As colunas derivadas (PROFIT, MARGIN_PERCENT) passam a viver no
+    warehouse: queries idênticas voltam do result cache de 24h do
+    Snowflake sem recomputar as expressões. Usa materialized view quando
+    a edição da conta permite; senão, view comum; se o papel for
+    somente-leitura (sem CREATE), devolve a subquery equivalente para
+    consultar MENU diretamente.
+    """
+    corpo = """
+        SELECT
+            MENU_ITEM_NAME,
+            ITEM_CATEGORY,
+            ITEM_SUBCATEGORY,
+            COST_OF_GOODS_USD,
+            SALE_PRICE_USD,
+            (SALE_PRICE_USD - COST_OF_GOODS_USD) AS PROFIT,
+            ROUND(((SALE_PRICE_USD - COST_OF_GOODS_USD) / SALE_PRICE_USD) * 100, 2) AS MARGIN_PERCENT
+        FROM MENU
+    """
+    with emprestar_conexao() as conn:
+        cur = conn.cursor()
+        try:
+            try:
+                # Materialized view exige edição Enterprise
+                cur.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS MENU_ENRICHED AS {corpo}")
+            except snowflake.connector.errors.ProgrammingError:
+                try:
+                    cur.execute(f"CREATE VIEW IF NOT EXISTS MENU_ENRICHED AS {corpo}")
+                except snowflake.connector.errors.ProgrammingError:
+                    # Papel sem privilégio de CREATE (dashboard
+                    # somente-leitura): consulta MENU com as expressões
+                    # inline, sem view
+                    return f"({corpo}) AS MENU_ENRICHED"
+            return 'MENU_ENRICHED'
+        finally:
+            cur.close()
+
+def _executar_query(query):
+    """Executa a query e materializa o resultado via Arrow (sem cache)"""
+    with emprestar_conexao() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(query)
+            df = cur.fetch_pandas_all()
+
+            # Converter colunas numéricas automaticamente
+            for col in df.columns:
+                # Tentar converter para numérico (colunas não numéricas
+                # ficam como estão; errors='ignore' saiu no pandas 3)
+                try:
+                    df[col] = pd.to_numeric(df[col])
+                except (ValueError, TypeError):
+                    pass
+
+            return df
+        finally:
+            cur.close()
+
 @st.cache_data(ttl=600)
 def run_query(query):
     """Executa query e retorna DataFrame (cache de 10 minutos)"""
-    conn = init_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(query)
-        df = cur.fetch_pandas_all()
-        
-        # Converter colunas numéricas automaticamente
-        for col in df.columns:
-            # Tentar converter para numérico
-            df[col] = pd.to_numeric(df[col], errors='ignore')
-        
-        return df
-    finally:
-        cur.close()
+    return _executar_query(query)
+
+@st.cache_data(ttl=600)
+def carregar_agregados():
+    """Dispara as queries agregadas do Dashboard em paralelo.
+
+    Cada ida ao Snowflake custa ~100-300 ms de latência; em threads o
+    tempo total cai para o da query mais lenta (cache de 10 minutos).
+    """
+    view = preparar_view_menu()
+    queries = (
+        f"""
+        SELECT
+            COUNT(*) AS TOTAL_ITENS,
+            AVG(SALE_PRICE_USD) AS PRECO_MEDIO,
+            AVG(PROFIT) AS LUCRO_MEDIO,
+            AVG(MARGIN_PERCENT) AS MARGEM_MEDIA
+        FROM {view}
+        """,
+        f"""
+        SELECT ITEM_CATEGORY, COUNT(*) AS QUANTIDADE
+        FROM {view}
+        GROUP BY ITEM_CATEGORY
+        """,
+        f"""
+        SELECT MENU_ITEM_NAME, MARGIN_PERCENT
+        FROM {view}
+        ORDER BY MARGIN_PERCENT DESC
+        LIMIT 10
+        """,
+        f"""
+        SELECT
+            ITEM_CATEGORY,
+            MIN(SALE_PRICE_USD) AS MINIMO,
+            APPROX_PERCENTILE(SALE_PRICE_USD, 0.25) AS Q1,
+            APPROX_PERCENTILE(SALE_PRICE_USD, 0.5) AS MEDIANA,
+            APPROX_PERCENTILE(SALE_PRICE_USD, 0.75) AS Q3,
+            MAX(SALE_PRICE_USD) AS MAXIMO
+        FROM {view}
+        GROUP BY ITEM_CATEGORY
+        """
+    )
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        kpis, cat_count, top10, box_stats = pool.map(_executar_query, queries)
+
+    cat_count.columns = ['Categoria', 'Quantidade']
+    return kpis, cat_count, top10, box_stats
+
+@st.cache_data(ttl=600)
+def carregar_menu():
+    """Carrega a tabela MENU completa com colunas derivadas (cache de 10 minutos)"""
+    # _executar_query direto: run_query guardaria uma segunda cópia do
+    # MENU bruto no cache, além da transformada que esta função já cacheia
+    view = preparar_view_menu()
+    df = _executar_query(f"""
+        SELECT
+            MENU_ITEM_NAME,
+            ITEM_CATEGORY,
+            ITEM_SUBCATEGORY,
+            COST_OF_GOODS_USD,
+            SALE_PRICE_USD,
+            PROFIT,
+            MARGIN_PERCENT
+        FROM {view}
+    """)
+
+    # Categoria/subcategoria como dtype 'category': filtros comparam
+    # códigos inteiros em vez de hashear strings a cada rerun
+    df['ITEM_CATEGORY'] = df['ITEM_CATEGORY'].astype('category')
+    df['ITEM_SUBCATEGORY'] = df['ITEM_SUBCATEGORY'].astype('category')
+
+    # Downcast numérico: float32 basta para preços em dólar e corta pela
+    # metade os bytes movidos em médias, filtros e serialização Plotly
+    for col in df.select_dtypes(include='float').columns:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+@st.cache_data(ttl=600)
+def opcoes_filtros():
+    """Opções dos filtros da aba Explorar, calculadas uma única vez"""
+    df = carregar_menu()
+    return (
+        tuple(df['ITEM_CATEGORY'].cat.categories),
+        tuple(df['ITEM_SUBCATEGORY'].cat.categories),
+        float(df['SALE_PRICE_USD'].min()),
+        float(df['SALE_PRICE_USD'].max())
+    )
+
+@st.cache_data(ttl=600)
+def filtrar_menu(categorias, subcategorias, preco_min, preco_max):
+    """Aplica os filtros da aba Explorar (cache por combinação de filtros)"""
+    df = carregar_menu()
+    return df[
+        df['ITEM_CATEGORY'].isin(categorias) &
+        df['ITEM_SUBCATEGORY'].isin(subcategorias) &
+        df['SALE_PRICE_USD'].between(preco_min, preco_max)
+    ]
+
+@st.cache_resource
+def obter_sql_sem():
+    """Limitador de queries ad-hoc simultâneas na aba SQL (uma vez por
+    processo, como o pool): protege o warehouse contra fila e queima de
+    créditos com muitos usuários"""
+    return Semaphore(4)
+
+def executar_query_stream(query):
+    """Executa a query em lotes e materializa em um DuckDB local.
+
+    Evita carregar resultados arbitrários (ex.: SELECT *) inteiros em um
+    DataFrame: cada lote Arrow vai para uma tabela exclusiva desta
+    execução — sessões concorrentes não disputam o mesmo nome nem
+    enxergam linhas umas das outras — e a UI pagina sobre ela.
+
+    Retorna (total de linhas, amostra de 1000 linhas, CSV completo em
+    bytes, Parquet completo em bytes) — os downloads cobrem o resultado
+    inteiro, exportado do DuckDB antes de descartar a tabela.
+    """
+    tabela = f"resultado_{uuid4().hex}"
+    dk = duckdb.connect('analytics.duckdb')
+    with emprestar_conexao() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(query)
+
+            primeiro = True
+            try:
+                for lote in cur.fetch_pandas_batches():
+                    dk.register('lote', lote)
+                    if primeiro:
+                        dk.execute(f"CREATE TABLE {tabela} AS SELECT * FROM lote")
+                        primeiro = False
+                    else:
+                        dk.execute(f"INSERT INTO {tabela} SELECT * FROM lote")
+                    dk.unregister('lote')
+            except snowflake.connector.errors.NotSupportedError:
+                # Comando sem resultado tabular (ex.: DDL)
+                return 0, pd.DataFrame(), b'', b''
+
+            if primeiro:
+                # SELECT sem nenhuma linha
+                return 0, pd.DataFrame(), b'', b''
+
+            total = dk.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+            amostra = dk.execute(f"SELECT * FROM {tabela} LIMIT 1000").fetch_df()
+
+            # Exporta o resultado completo via Arrow para os downloads
+            completo = dk.execute(f"SELECT * FROM {tabela}").fetch_arrow_table()
+            buf_csv = BytesIO()
+            pacsv.write_csv(completo, buf_csv)
+            buf_parquet = BytesIO()
+            pq.write_table(completo, buf_parquet)
+
+            return total, amostra, buf_csv.getvalue(), buf_parquet.getvalue()
+        finally:
+            cur.close()
+            dk.execute(f"DROP TABLE IF EXISTS {tabela}")
+            dk.close()
+
+@st.cache_data
+def construir_pizza(cat_count):
+    """Pizza de itens por categoria (cache pelo df agregado, minúsculo)"""
+    fig = px.pie(cat_count, values='Quantidade', names='Categoria',
+                 title="Itens por Categoria",
+                 color_discrete_sequence=px.colors.qualitative.Set3)
+    # to_dict(): go.Figure não serializa no cache; reconstrói na exibição
+    return fig.to_dict()
+
+@st.cache_data
+def construir_barras_top10(top10):
+    """Barras horizontais do top 10 de margem (cache pelas 10 linhas)"""
+    fig = px.bar(top10, x='MARGIN_PERCENT', y='MENU_ITEM_NAME',
+                 orientation='h',
+                 title="Produtos Mais Lucrativos (%)",
+                 color='MARGIN_PERCENT',
+                 color_continuous_scale='Greens',
+                 labels={'MARGIN_PERCENT': 'Margem (%)',
+                         'MENU_ITEM_NAME': 'Produto'})
+    return fig.to_dict()
+
+@st.cache_data
+def construir_dispersao(df_scatter):
+    """Dispersão custo x preço (cache pela amostra de até 2000 linhas)"""
+    fig = px.scatter(df_scatter,
+                     x='COST_OF_GOODS_USD',
+                     y='SALE_PRICE_USD',
+                     color='ITEM_CATEGORY',
+                     size='PROFIT',
+                     hover_data=['MENU_ITEM_NAME'],
+                     title="Relação Custo x Preço de Venda",
+                     labels={'COST_OF_GOODS_USD': 'Custo (USD)',
+                             'SALE_PRICE_USD': 'Preço de Venda (USD)'},
+                     template='plotly_white',
+                     render_mode='webgl')
+    return fig.to_dict()
+
+@st.cache_data
+def construir_box(box_stats):
+    """Box plot de preços a partir dos quartis agregados no Snowflake"""
+    fig = go.Figure()
+    for _, linha in box_stats.iterrows():
+        fig.add_trace(go.Box(
+            name=linha['ITEM_CATEGORY'],
+            lowerfence=[linha['MINIMO']],
+            q1=[linha['Q1']],
+            median=[linha['MEDIANA']],
+            q3=[linha['Q3']],
+            upperfence=[linha['MAXIMO']]
+        ))
+    fig.update_layout(title="Variação de Preços",
+                      xaxis_title='Categoria',
+                      yaxis_title='Preço (USD)',
+                      showlegend=False)
+    return fig.to_dict()
+
+def df_para_csv(df):
+    """Gera CSV em bytes com o escritor vetorizado do PyArrow"""
+    buf = BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
+def df_para_parquet(df):
+    """Gera Parquet em bytes (payload 5-10x menor que CSV)"""
+    buf = BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
 
 # ============================================================================
 # HEADER
@@ -70,9 +402,9 @@ st.markdown("**Integração Streamlit + Snowflake Data Warehouse**")
 with st.sidebar:
     st.header("⚙️ Configurações")
     
-    # Verificar conexão
+    # Verificar conexão (sonda cacheada: não reabre nada a cada rerun)
     try:
-        conn = init_connection()
+        verificar_conexao()
         st.success("✅ Conectado ao Snowflake")
         
         with st.expander("ℹ️ Detalhes da Conexão"):
@@ -133,32 +465,26 @@ if conectado:
         st.header("📊 Análise do Cardápio TastyBytes")
         
         # Carregar dados
+        # Agregados (KPIs, pizza, top 10) são calculados no Snowflake:
+        # voltam poucas linhas em vez da tabela inteira. O df completo só é
+        # usado nos gráficos que precisam de dados linha a linha.
         with st.spinner("Carregando dados do Snowflake..."):
-            df = run_query("""
-                SELECT 
-                    MENU_ITEM_NAME,
-                    ITEM_CATEGORY,
-                    ITEM_SUBCATEGORY,
-                    COST_OF_GOODS_USD,
-                    SALE_PRICE_USD,
-                    (SALE_PRICE_USD - COST_OF_GOODS_USD) AS PROFIT,
-                    ROUND(((SALE_PRICE_USD - COST_OF_GOODS_USD) / SALE_PRICE_USD) * 100, 2) AS MARGIN_PERCENT
-                FROM MENU
-            """)
-        
+            kpis, cat_count, top10, box_stats = carregar_agregados()
+            df = carregar_menu()
+
         st.success(f"✅ {len(df)} itens carregados do warehouse")
-        
+
         # KPIs
         col1, col2, col3, col4 = st.columns(4)
-        
+
         with col1:
-            st.metric("Total de Itens", len(df))
+            st.metric("Total de Itens", int(kpis['TOTAL_ITENS'].iloc[0]))
         with col2:
-            st.metric("Preço Médio", f"${df['SALE_PRICE_USD'].mean():.2f}")
+            st.metric("Preço Médio", f"${kpis['PRECO_MEDIO'].iloc[0]:.2f}")
         with col3:
-            st.metric("Lucro Médio/Item", f"${df['PROFIT'].mean():.2f}")
+            st.metric("Lucro Médio/Item", f"${kpis['LUCRO_MEDIO'].iloc[0]:.2f}")
         with col4:
-            st.metric("Margem Média", f"{df['MARGIN_PERCENT'].mean():.1f}%")
+            st.metric("Margem Média", f"{kpis['MARGEM_MEDIA'].iloc[0]:.1f}%")
         
         st.markdown("---")
         
@@ -167,53 +493,31 @@ if conectado:
         
         with col1:
             st.subheader("📊 Distribuição por Categoria")
-            
-            cat_count = df['ITEM_CATEGORY'].value_counts().reset_index()
-            cat_count.columns = ['Categoria', 'Quantidade']
-            
-            fig1 = px.pie(cat_count, values='Quantidade', names='Categoria',
-                         title="Itens por Categoria",
-                         color_discrete_sequence=px.colors.qualitative.Set3)
+
+            fig1 = go.Figure(construir_pizza(cat_count))
             st.plotly_chart(fig1, use_container_width=True)
-        
+
         with col2:
             st.subheader("💰 Top 10 - Maior Margem")
-            
-            top10 = df.nlargest(10, 'MARGIN_PERCENT')[['MENU_ITEM_NAME', 'MARGIN_PERCENT']]
-            
-            fig2 = px.bar(top10, x='MARGIN_PERCENT', y='MENU_ITEM_NAME',
-                         orientation='h', 
-                         title="Produtos Mais Lucrativos (%)",
-                         color='MARGIN_PERCENT',
-                         color_continuous_scale='Greens',
-                         labels={'MARGIN_PERCENT': 'Margem (%)', 
-                                'MENU_ITEM_NAME': 'Produto'})
+
+            fig2 = go.Figure(construir_barras_top10(top10))
             st.plotly_chart(fig2, use_container_width=True)
         
         # Gráfico de dispersão
         st.subheader("🎯 Análise: Custo vs Preço")
         
-        fig3 = px.scatter(df, 
-                         x='COST_OF_GOODS_USD', 
-                         y='SALE_PRICE_USD',
-                         color='ITEM_CATEGORY',
-                         size='PROFIT',
-                         hover_data=['MENU_ITEM_NAME'],
-                         title="Relação Custo x Preço de Venda",
-                         labels={'COST_OF_GOODS_USD': 'Custo (USD)', 
-                                'SALE_PRICE_USD': 'Preço de Venda (USD)'},
-                         template='plotly_white')
-        
+        # Amostra no servidor: milhares de pontos travam o navegador
+        df_scatter = df.sample(2000, random_state=0) if len(df) > 2000 else df
+
+        fig3 = go.Figure(construir_dispersao(df_scatter))
         st.plotly_chart(fig3, use_container_width=True)
         
         # Box plot
         st.subheader("📦 Distribuição de Preços por Categoria")
         
-        fig4 = px.box(df, x='ITEM_CATEGORY', y='SALE_PRICE_USD',
-                     color='ITEM_CATEGORY',
-                     title="Variação de Preços",
-                     labels={'SALE_PRICE_USD': 'Preço (USD)', 
-                            'ITEM_CATEGORY': 'Categoria'})
+        # Quartis pré-calculados no Snowflake: o box plot recebe 5 números
+        # por categoria em vez de todas as linhas
+        fig4 = go.Figure(construir_box(box_stats))
         st.plotly_chart(fig4, use_container_width=True)
     
     # ========================================================================
@@ -223,70 +527,77 @@ if conectado:
     with tab2:
         st.header("🔍 Explorar Dados Detalhados")
         
-        # Filtros
+        # Filtros (opções vêm prontas do cache, sem rescan das colunas)
         st.subheader("Filtros")
-        
+
+        cats_opcoes, subs_opcoes, preco_min, preco_max = opcoes_filtros()
+
         col1, col2, col3 = st.columns(3)
-        
+
         with col1:
             categorias = st.multiselect(
                 "Categorias",
-                options=df['ITEM_CATEGORY'].unique(),
-                default=df['ITEM_CATEGORY'].unique()
+                options=cats_opcoes,
+                default=cats_opcoes
             )
-        
+
         with col2:
             subcategorias = st.multiselect(
                 "Subcategorias",
-                options=df['ITEM_SUBCATEGORY'].unique(),
-                default=df['ITEM_SUBCATEGORY'].unique()
+                options=subs_opcoes,
+                default=subs_opcoes
             )
-        
+
         with col3:
             preco_range = st.slider(
                 "Faixa de Preço (USD)",
-                min_value=float(df['SALE_PRICE_USD'].min()),
-                max_value=float(df['SALE_PRICE_USD'].max()),
-                value=(float(df['SALE_PRICE_USD'].min()), float(df['SALE_PRICE_USD'].max()))
+                min_value=preco_min,
+                max_value=preco_max,
+                value=(preco_min, preco_max)
             )
         
-        # Filtrar dados
-        df_filtrado = df[
-            (df['ITEM_CATEGORY'].isin(categorias)) &
-            (df['ITEM_SUBCATEGORY'].isin(subcategorias)) &
-            (df['SALE_PRICE_USD'] >= preco_range[0]) &
-            (df['SALE_PRICE_USD'] <= preco_range[1])
-        ]
+        # Filtrar dados (tuplas ordenadas = chave de cache estável)
+        df_filtrado = filtrar_menu(
+            tuple(sorted(categorias)),
+            tuple(sorted(subcategorias)),
+            preco_range[0],
+            preco_range[1]
+        )
         
         st.markdown(f"**{len(df_filtrado)}** itens encontrados")
         
-        # Estatísticas resumidas
+        # Estatísticas resumidas (uma varredura só das três colunas)
+        medias = df_filtrado[['SALE_PRICE_USD', 'PROFIT', 'MARGIN_PERCENT']].agg('mean')
+
         col1, col2, col3 = st.columns(3)
-        
+
         with col1:
-            st.metric("Preço Médio", f"${df_filtrado['SALE_PRICE_USD'].mean():.2f}")
+            st.metric("Preço Médio", f"${medias['SALE_PRICE_USD']:.2f}")
         with col2:
-            st.metric("Lucro Médio", f"${df_filtrado['PROFIT'].mean():.2f}")
+            st.metric("Lucro Médio", f"${medias['PROFIT']:.2f}")
         with col3:
-            st.metric("Margem Média", f"{df_filtrado['MARGIN_PERCENT'].mean():.1f}%")
+            st.metric("Margem Média", f"{medias['MARGIN_PERCENT']:.1f}%")
         
         st.markdown("---")
         
         # Tabela de dados
         st.subheader("📋 Dados Detalhados")
+        # column_config formata no frontend, sem o Styler alocar uma
+        # string Python por célula a cada mudança de filtro
         st.dataframe(
-            df_filtrado.style.format({
-                'COST_OF_GOODS_USD': '${:.2f}',
-                'SALE_PRICE_USD': '${:.2f}',
-                'PROFIT': '${:.2f}',
-                'MARGIN_PERCENT': '{:.1f}%'
-            }),
+            df_filtrado,
+            column_config={
+                'COST_OF_GOODS_USD': st.column_config.NumberColumn(format='$%.2f'),
+                'SALE_PRICE_USD': st.column_config.NumberColumn(format='$%.2f'),
+                'PROFIT': st.column_config.NumberColumn(format='$%.2f'),
+                'MARGIN_PERCENT': st.column_config.NumberColumn(format='%.1f%%')
+            },
             use_container_width=True,
             height=400
         )
         
         # Botão de download
-        csv = df_filtrado.to_csv(index=False).encode('utf-8')
+        csv = df_para_csv(df_filtrado)
         st.download_button(
             label="📥 Baixar CSV",
             data=csv,
@@ -337,22 +648,31 @@ if conectado:
         if st.button("▶️ Executar Query", type="primary", use_container_width=True):
             try:
                 with st.spinner("Executando no Snowflake..."):
-                    resultado = run_query(query_text)
-                
-                st.success(f"✅ Query executada! {len(resultado)} linhas retornadas em {resultado.shape[1]} colunas")
-                
-                # Mostrar resultado
+                    with obter_sql_sem():
+                        total_linhas, resultado, csv, parquet = executar_query_stream(query_text)
+
+                st.success(f"✅ Query executada! {total_linhas} linhas retornadas em {resultado.shape[1]} colunas")
+
+                # Mostrar resultado (amostra paginada do DuckDB)
                 st.subheader("📊 Resultado:")
+                if total_linhas > len(resultado):
+                    st.caption(f"Exibindo as primeiras {len(resultado)} de {total_linhas} linhas")
                 st.dataframe(resultado, use_container_width=True)
                 
-                # Download
-                csv = resultado.to_csv(index=False).encode('utf-8')
+                # Download (resultado completo, não só a amostra exibida)
                 st.download_button(
                     label="📥 Baixar Resultado CSV",
                     data=csv,
                     file_name=f"query_resultado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                     mime="text/csv"
                 )
+
+                st.download_button(
+                    label="📥 Baixar Resultado Parquet",
+                    data=parquet,
+                    file_name=f"query_resultado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet",
+                    mime="application/octet-stream"
+                )
                 
             except Exception as e:
                 st.error(f"❌ Erro ao executar query:")
@@ -405,22 +725,25 @@ if conectado:
         role = "ACCOUNTADMIN"
         ```
         
-        **2. Conexão com Cache (CORRIGIDA):**
-        
+        **2. Pool de Conexões com Cache:**
+
         ```python
         @st.cache_resource
-        def init_connection():
-            return snowflake.connector.connect(...)
-        
+        def obter_pool():
+            pool = queue.Queue(maxsize=POOL_SIZE)
+            for _ in range(POOL_SIZE):
+                pool.put(snowflake.connector.connect(...))
+            return pool
+
         @st.cache_data(ttl=600)
         def run_query(query):
-            conn = init_connection()
-            cur = conn.cursor()
-            try:
-                cur.execute(query)
-                return cur.fetch_pandas_all()
-            finally:
-                cur.close()
+            with emprestar_conexao() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(query)
+                    return cur.fetch_pandas_all()
+                finally:
+                    cur.close()
         ```
         
         ---